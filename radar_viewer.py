@@ -1,46 +1,140 @@
 import os
+
+# Pin BLAS/OpenMP pools to the core count before numpy loads them, so they
+# don't oversubscribe small cloud runners
+_n_threads = str(os.cpu_count() or 2)
+for _var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS'):
+    os.environ.setdefault(_var, _n_threads)
+
 import sys
+import argparse
+import json
+import time
+import pickle
+import zipfile
+import multiprocessing.forkserver
 import shutil
 import base64
-import nexradaws
+import importlib.metadata
+import boto3
 import pyart
 import numpy as np
 import folium
 from folium import plugins
+import matplotlib
 import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+from PIL import Image
+from numba import njit, prange
+from botocore import UNSIGNED
+from botocore.client import Config
+from collections import namedtuple
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 # --- Configuration ---
 RADAR_SITES = ['KCCX', 'KDIX']
+NEXRAD_BUCKET = 'noaa-nexrad-level2'
 # Region: PA/NJ
 GRID_LAT_MIN, GRID_LAT_MAX = 39.0, 42.0
 GRID_LON_MIN, GRID_LON_MAX = -79.0, -73.0
-GRID_SHAPE = (1, 600, 800) 
+GRID_ORIGIN_LAT = (GRID_LAT_MIN + GRID_LAT_MAX) / 2
+GRID_ORIGIN_LON = (GRID_LON_MIN + GRID_LON_MAX) / 2
+# Leaflet smooths the overlay when scaling, so a coarser grid is fine at zoom <= 8
+GRID_SHAPE = (1, 300, 400)
+# Reflectivity is the only layer visible on first paint; the rest are opt-in
+DEFAULT_FIELDS = ['reflectivity']
+EXTRA_FIELDS = ['velocity', 'cross_correlation_ratio']
+# Tilts above this are dropped to save gridding work. Far out they overshoot the
+# 0-2 km layer, but near each radar (e.g. 2.4 deg is ~1.3 km up at 30 km) they
+# would still contribute, so close-range cells rely on the lower tilts only
+MAX_ELEVATION = 1.5
+# Number of recent scans kept in the download directory between runs
+CACHE_SIZE = 8
+# Web-mercator zoom levels cut into XYZ tiles. At zoom 7 a tile pixel (~930 m here)
+# is roughly one default grid cell (~1.1-1.3 km); above that Leaflet upscales the
+# zoom-7 tiles with smooth browser interpolation instead of baking in blocky cells
+TILE_DIR = 'tiles'
+TILE_ZOOMS = range(5, 8)
+TILE_SIZE = 256
+LAYERS = [
+    # (field, tile subdir, layer name, vmin, vmax, colormap, shown by default)
+    ('reflectivity', 'ref', 'Reflectivity', -10, 70, 'HomeyerRainbow', True),
+    ('velocity', 'vel', 'Velocity', -30, 30, 'BuDRd18', False),
+    ('cross_correlation_ratio', 'cc', 'Correlation Coeff', 0.8, 1.0, 'RefDiff', False),
+]
+# Last processed scan per site; a run whose scans match it is skipped
+STATE_FILE = 'state.json'
+# Only skip while the existing map is younger than this (seconds)
+STATE_MAX_AGE = 15 * 60
+# Precomputed 256-entry RGBA tables for the overlay colormaps
+LUT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'luts.npz')
+
+Scan = namedtuple('Scan', ['site', 'key', 'filename', 'scan_time'])
+
+_S3 = None
+
+def _s3_client():
+    """Return the shared S3 client, so listing and downloads reuse one connection pool."""
+    global _S3
+    if _S3 is None:
+        # The NEXRAD archive is public, so requests don't need to be signed
+        _S3 = boto3.client('s3', config=Config(signature_version=UNSIGNED, max_pool_connections=8))
+    return _S3
+
+def _latest_key(s3, prefix, start_after=None):
+    kwargs = {'Bucket': NEXRAD_BUCKET, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+
+    latest = None
+    for page in s3.get_paginator('list_objects_v2').paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            # Keys sort in scan-time order; skip the metadata-only files
+            if not obj['Key'].endswith('_MDM') and (latest is None or obj['Key'] > latest):
+                latest = obj['Key']
+    return latest
+
+def _scan_from_key(site, key):
+    filename = os.path.basename(key)
+    try:
+        scan_time = datetime.strptime(filename[4:19], '%Y%m%d_%H%M%S')
+    except ValueError:
+        scan_time = None
+    return Scan(site, key, filename, scan_time)
+
+def _find_latest_scan(s3, site, now):
+    today = f"{now:%Y/%m/%d}/{site}/"
+    yesterday = f"{now - timedelta(days=1):%Y/%m/%d}/{site}/"
+
+    # Start the listing an hour back so a normal run only pages through a few keys,
+    # then widen to the whole day and finally "Yesterday" for the UTC midnight edge case
+    attempts = [(today, None), (yesterday, None)]
+    hour_ago = now - timedelta(hours=1)
+    if hour_ago.date() == now.date():
+        attempts.insert(0, (today, f"{today}{site}{hour_ago:%Y%m%d_%H}"))
+
+    for prefix, start_after in attempts:
+        try:
+            key = _latest_key(s3, prefix, start_after)
+        except Exception as e:
+            print(f"  - Error checking {prefix}: {e}")
+            continue
+        if key:
+            return _scan_from_key(site, key)
+    return None
 
 def get_latest_scans():
-    conn = nexradaws.NexradAwsInterface()
-    scans = []
+    s3 = _s3_client()
+    now = datetime.utcnow()
     
-    # We check "Today" and "Yesterday" to handle the UTC midnight edge case
-    check_dates = [datetime.utcnow(), datetime.utcnow() - timedelta(days=1)]
-    
-    for site in RADAR_SITES:
-        site_scans = []
+    # S3 listing latency dominates, so query every site at once
+    with ThreadPoolExecutor(max_workers=len(RADAR_SITES)) as ex:
+        found = list(ex.map(lambda site: _find_latest_scan(s3, site, now), RADAR_SITES))
+
+    scans = []
+    for site, latest in zip(RADAR_SITES, found):
         print(f"Checking {site}...")
-        
-        for date in check_dates:
-            try:
-                found = conn.get_avail_scans(date.year, date.month, date.day, site)
-                if found:
-                    site_scans.extend(found)
-            except Exception as e:
-                print(f"  - Error checking {date.strftime('%Y-%m-%d')}: {e}")
-
-        if site_scans:
-            # Sort by time and pick the absolute latest
-            site_scans.sort(key=lambda x: x.scan_time)
-            latest = site_scans[-1]
+        if latest:
             print(f"  -> Found newest scan: {latest.filename} ({latest.scan_time})")
             scans.append(latest)
         else:
@@ -48,49 +142,302 @@ def get_latest_scans():
             
     return scans
 
+def subset_radar_to_grid(radar):
+    """Drop the upper tilts, which only sample the grid layer close to the radar."""
+    low = np.flatnonzero(radar.fixed_angle['data'] <= MAX_ELEVATION)
+    if 0 < len(low) < radar.nsweeps:
+        radar = radar.extract_sweeps(low.tolist())
+    return radar
+
+def _decode_archive(filepath):
+    try:
+        # Only materialize the moments we can grid; the dual-pol extras are skipped
+        return pyart.io.read_nexrad_archive(filepath, include_fields=DEFAULT_FIELDS + EXTRA_FIELDS)
+    except Exception:
+        # pyart.io.read handles compression and other formats automatically
+        return pyart.io.read(filepath)
+
+def _read_radar(filepath):
+    try:
+        radar = subset_radar_to_grid(_decode_archive(filepath))
+    except Exception as e:
+        print(f"Failed to read {os.path.basename(filepath)}: {e}")
+        return None
+
+    # Keep the decoded radar so the next run can skip the NEXRAD parser; write under a
+    # temporary name so an interrupted dump never leaves a truncated cache entry
+    pkl = filepath + '.pkl'
+    try:
+        with open(pkl + '.part', 'wb') as f:
+            pickle.dump(radar, f, protocol=5)
+        os.replace(pkl + '.part', pkl)
+    except OSError as e:
+        print(f"Failed to cache {os.path.basename(filepath)}: {e}")
+    return radar
+
+def _load_cached_radar(path):
+    try:
+        with open(path, 'rb') as f:
+            radar = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable cache entry {os.path.basename(path)}: {e}")
+        return None
+    os.utime(path) # Mark as recently used
+    return radar
+
+def prune_cache(download_dir, keep=CACHE_SIZE):
+    """Remove all but the `keep` most recently used scans from the cache."""
+    entries = {}
+    for name in os.listdir(download_dir):
+        path = os.path.join(download_dir, name)
+        key = name[:-len('.pkl')] if name.endswith('.pkl') else name
+        entries.setdefault(key, []).append(path)
+
+    by_age = sorted(entries.values(), key=lambda paths: max(os.path.getmtime(p) for p in paths), reverse=True)
+    for paths in by_age[keep:]:
+        for path in paths:
+            os.remove(path)
+
+def _fetch_scan(s3, scan, download_dir):
+    path = os.path.join(download_dir, scan.filename)
+    if not os.path.exists(path):
+        try:
+            # Download under a temporary name so an interrupted fetch never looks cached
+            s3.download_file(NEXRAD_BUCKET, scan.key, path + '.part')
+            os.replace(path + '.part', path)
+        except Exception as e:
+            print(f"Failed to download {scan.filename}: {e}")
+            return None
+    return path
+
+def _decoder_context():
+    """Multiprocessing context for the decoder pool, already warming up if possible."""
+    # Workers must not be forked while download threads hold boto3/urllib3 locks
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+
+    # Start the server now so the heavy imports run alongside the S3 fetches instead
+    # of after the first download lands. The dependencies are listed by name because
+    # some Pythons (e.g. 3.11) silently skip the '__main__' preload for scripts;
+    # workers then only redo this module's own top-level setup
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(['__main__', 'numpy', 'pyart', 'numba', 'boto3', 'folium',
+                                'matplotlib.pyplot', 'PIL.Image'])
+    multiprocessing.forkserver.ensure_running()
+    return ctx
+
 def download_and_read_scans(scans, download_dir='radar_data'):
     if not os.path.exists(download_dir):
         os.makedirs(download_dir)
         
-    conn = nexradaws.NexradAwsInterface()
-    results = conn.download(scans, download_dir)
-    
-    radars = []
-    for download in results.success:
+    radars = {}
+    for scan in scans:
+        pkl = os.path.join(download_dir, scan.filename + '.pkl')
+        if os.path.exists(pkl):
+            radar = _load_cached_radar(pkl)
+            if radar is not None:
+                radars[scan.filename] = radar
+                print(f"Loaded cached data for {scan.filename}")
+
+    to_read = [s for s in scans if s.filename not in radars]
+    if to_read:
+        s3 = _s3_client()
+        # Each archive is handed to a decoder process as soon as its download lands,
+        # so parsing one radar overlaps with fetching the next
+        mp_context = _decoder_context()
+        with ThreadPoolExecutor(max_workers=len(to_read)) as io_pool, \
+                ProcessPoolExecutor(max_workers=len(to_read), mp_context=mp_context) as cpu_pool:
+            fetches = [io_pool.submit(_fetch_scan, s3, scan, download_dir) for scan in to_read]
+            decodes = {}
+            for fetch in as_completed(fetches):
+                path = fetch.result()
+                if path is not None:
+                    decodes[cpu_pool.submit(_read_radar, path)] = path
+
+            for decode in as_completed(decodes):
+                radar = decode.result()
+                if radar is not None:
+                    name = os.path.basename(decodes[decode])
+                    radars[name] = radar
+                    print(f"Loaded data for {name}")
+
+    prune_cache(download_dir)
+    # Pair each radar with its scan so callers know which sites actually loaded
+    return [(s, radars[s.filename]) for s in scans if s.filename in radars]
+
+def _build_lut(cmap_name):
+    # Depending on the pyart version its colormaps are registered bare or 'pyart_'-prefixed
+    for name in (cmap_name, 'pyart_' + cmap_name):
         try:
-            # pyart.io.read handles compression automatically
-            radar = pyart.io.read(download.filepath)
-            radars.append(radar)
-            print(f"Loaded data for {download.filename}")
-        except Exception as e:
-            print(f"Failed to read {download.filename}: {e}")
-            
-    return radars
+            cmap = plt.get_cmap(name)
+        except ValueError:
+            continue
+        return cmap(np.linspace(0, 1, 256), bytes=True)
+    raise ValueError(f"Colormap {cmap_name!r} is not registered; is pyart installed?")
 
-def generate_image_overlay(grid, field, filename, vmin, vmax, cmap_name):
-    if field not in grid.fields:
-        print(f"Skipping {field}: Data not in grid.")
-        return False
+def _lut_cache_key():
+    """Versions the cached tables were built with; any change forces a rebuild."""
+    versions = [f"matplotlib={matplotlib.__version__}", f"pyart={pyart.__version__}"]
+    try:
+        # Newer pyart releases take their colormaps from cmweather
+        versions.append(f"cmweather={importlib.metadata.version('cmweather')}")
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    return ';'.join(versions)
 
-    data = grid.fields[field]['data'][0]
-    
+def _load_luts(names, path=LUT_CACHE):
+    """Load colormap LUTs from the .npz cache, rebuilding it when stale or unreadable."""
+    key = _lut_cache_key()
     try:
-        cmap = plt.get_cmap(cmap_name)
-    except ValueError:
-        cmap = plt.get_cmap('viridis') # Fallback
+        with np.load(path) as cached:
+            if str(cached['__key__']) == key:
+                return {name: cached[name] for name in names}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        pass # Missing, truncated or from an older layout; rebuild below
 
-    norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
-    mappable = plt.cm.ScalarMappable(norm=norm, cmap=cmap)
-    image_data = mappable.to_rgba(data)
-    
-    if np.ma.is_masked(data):
-        image_data[data.mask, 3] = 0.0 # Make 'no data' pixels transparent
+    luts = {name: _build_lut(name) for name in names}
+    try:
+        # Write under a temporary name so an interrupted save never leaves a corrupt cache
+        with open(path + '.part', 'wb') as f:
+            np.savez(f, __key__=np.array(key), **luts)
+        os.replace(path + '.part', path)
+    except OSError as e:
+        # e.g. a read-only install; the in-memory tables are all we need
+        print(f"Could not write colormap cache {path}: {e}")
+    return luts
+
+_LUTS = _load_luts(tuple(layer[5] for layer in LAYERS))
+
+def get_lut(cmap_name):
+    """Return a cached 256-entry uint8 RGBA lookup table for a colormap."""
+    lut = _LUTS.get(cmap_name)
+    if lut is None:
+        lut = _LUTS[cmap_name] = _build_lut(cmap_name)
+    return lut
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _colorize(data, mask, lut, vmin, inv, out):
+    # Normalize, clip, LUT-index and mask in one pass; rows are written
+    # bottom-up since the grid origin is the south edge
+    H, W = data.shape
+    for i in prange(H):
+        row = H - 1 - i
+        for j in range(W):
+            if mask[i, j]:
+                out[row, j, 0] = 0; out[row, j, 1] = 0
+                out[row, j, 2] = 0; out[row, j, 3] = 0
+            else:
+                v = (data[i, j] - vmin) * inv
+                if v < 0:
+                    v = 0
+                elif v > 255:
+                    v = 255
+                k = np.uint8(v)
+                out[row, j, 0] = lut[k, 0]; out[row, j, 1] = lut[k, 1]
+                out[row, j, 2] = lut[k, 2]; out[row, j, 3] = lut[k, 3]
+
+def grid_limits():
+    """Grid limits (m from the grid origin) that cover the whole lat/lon box."""
+    lon, lat = np.meshgrid(np.linspace(GRID_LON_MIN, GRID_LON_MAX, 50),
+                           np.linspace(GRID_LAT_MIN, GRID_LAT_MAX, 50))
+    x, y = pyart.core.geographic_to_cartesian_aeqd(lon, lat, GRID_ORIGIN_LON, GRID_ORIGIN_LAT)
+    return ((0, 2000), (y.min(), y.max()), (x.min(), x.max()))
+
+def _lonlat_to_tile(lon, lat, z):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n)
+    return x, y
+
+def tile_index(grid):
+    """Map every web-mercator tile pixel over the box to its source grid cell.
+
+    Returns a list of (relative_path, valid, rows, cols) where rows/cols index
+    the top-down colorized image for the pixels flagged in `valid`. The lookup
+    only depends on the grid geometry, so it is shared by every layer.
+    """
+    xs, ys = grid.x['data'], grid.y['data']
+    nx, ny = len(xs), len(ys)
+    lon0, lat0 = grid.origin_longitude['data'][0], grid.origin_latitude['data'][0]
+    offsets = np.arange(TILE_SIZE) + 0.5
+
+    tiles = []
+    for z in TILE_ZOOMS:
+        n = 2 ** z * TILE_SIZE
+        tx_min, ty_min = _lonlat_to_tile(GRID_LON_MIN, GRID_LAT_MAX, z)
+        tx_max, ty_max = _lonlat_to_tile(GRID_LON_MAX, GRID_LAT_MIN, z)
+        for tx in range(tx_min, tx_max + 1):
+            for ty in range(ty_min, ty_max + 1):
+                lon = (tx * TILE_SIZE + offsets) / n * 360.0 - 180.0
+                lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ty * TILE_SIZE + offsets) / n))))
+                x, y = pyart.core.geographic_to_cartesian_aeqd(*np.meshgrid(lon, lat), lon0, lat0)
+
+                # Nearest grid cell; at these zooms a tile pixel is no finer than a cell
+                ix = np.rint((x - xs[0]) / (xs[1] - xs[0])).astype(np.intp)
+                iy = np.rint((y - ys[0]) / (ys[1] - ys[0])).astype(np.intp)
+                valid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+                if valid.any():
+                    path = os.path.join(str(z), str(tx), f"{ty}.webp")
+                    tiles.append((path, valid, ny - 1 - iy[valid], ix[valid]))
+    return tiles
+
+def write_tiles(image_data, tiles, tile_dir):
+    count = 0
+    tile = np.empty((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    for path, valid, rows, cols in tiles:
+        tile[:] = 0
+        tile[valid] = image_data[rows, cols]
+        if not tile[..., 3].any():
+            continue # Fully transparent; Leaflet just leaves the missing tile blank
+
+        path = os.path.join(tile_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Lossless WebP keeps the colour scale exact and is much smaller than PNG
+        Image.fromarray(tile, 'RGBA').save(path, 'WEBP', lossless=True, method=1)
+        count += 1
+    return count
+
+def colorize_field(grid, field, vmin, vmax, cmap_name):
+    data = grid.fields[field]['data'][0]
+    mask = np.ma.getmaskarray(data) # 'no data' pixels become transparent
     
-    plt.imsave(filename, image_data, origin='lower')
-    print(f"Generated {filename}")
-    return True
+    image_data = np.empty(data.shape + (4,), dtype=np.uint8)
+    # LAYERS mixes int and float limits; pass floats so the kernel compiles only once
+    _colorize(np.ma.getdata(data), mask, get_lut(cmap_name), float(vmin), 255.0 / (vmax - vmin), image_data)
+    return image_data
+
+def generate_tile_layers(grid, tiles, fields, layers=LAYERS):
+    """Render the layers for the requested `fields`, returning the ones generated.
+
+    Colorizing stays on this thread (the kernel is already parallel); the
+    WebP encodes of the different layers overlap on a thread pool.
+    """
+    # Start clean so neither empty tiles nor layers skipped this run (e.g. without
+    # --all-fields) leave stale echoes behind to be deployed
+    shutil.rmtree(TILE_DIR, ignore_errors=True)
+    jobs = []
+    with ThreadPoolExecutor(max_workers=len(layers)) as ex:
+        for layer in [layer for layer in layers if layer[0] in fields]:
+            field, subdir, _, vmin, vmax, cmap_name, _ = layer
+            if field not in grid.fields:
+                print(f"Skipping {field}: Data not in grid.")
+                continue
+            image_data = colorize_field(grid, field, vmin, vmax, cmap_name)
+            jobs.append((layer, ex.submit(write_tiles, image_data, tiles, os.path.join(TILE_DIR, subdir))))
+
+    for layer, job in jobs:
+        print(f"Generated {job.result()} tiles in {os.path.join(TILE_DIR, layer[1])}")
+    return [layer for layer, _ in jobs]
 
-def create_map(radars):
+def add_tile_layer(m, tile_dir, name, show):
+    folium.raster_layers.TileLayer(
+        tiles=tile_dir + '/{z}/{x}/{y}.webp', attr='NEXRAD Level-II (NOAA)', name=name,
+        overlay=True, show=show, opacity=0.7,
+        min_native_zoom=TILE_ZOOMS[0], max_native_zoom=TILE_ZOOMS[-1],
+        bounds=[[GRID_LAT_MIN, GRID_LON_MIN], [GRID_LAT_MAX, GRID_LON_MAX]]
+    ).add_to(m)
+
+def create_map(radars, fields=DEFAULT_FIELDS, grid_shape=GRID_SHAPE, weighting_function='Barnes2'):
     if not radars:
         print("Error: No radar objects available to grid.")
         sys.exit(1) # Force GitHub Action to fail
@@ -99,46 +446,27 @@ def create_map(radars):
     try:
         grid = pyart.map.grid_from_radars(
             radars,
-            grid_shape=GRID_SHAPE,
-            grid_limits=((0, 2000), 
-                         (GRID_LAT_MIN, GRID_LAT_MAX), 
-                         (GRID_LON_MIN, GRID_LON_MAX)),
-            grid_origin_lat=(GRID_LAT_MIN + GRID_LAT_MAX) / 2,
-            grid_origin_lon=(GRID_LON_MIN + GRID_LON_MAX) / 2,
-            fields=['reflectivity', 'velocity', 'cross_correlation_ratio']
+            grid_shape=grid_shape,
+            grid_limits=grid_limits(),
+            grid_origin_lat=GRID_ORIGIN_LAT,
+            grid_origin_lon=GRID_ORIGIN_LON,
+            fields=fields,
+            weighting_function=weighting_function
         )
     except Exception as e:
         print(f"Gridding Failed: {e}")
         sys.exit(1)
 
     # Base Map
-    center_lat = (GRID_LAT_MIN + GRID_LAT_MAX) / 2
-    center_lon = (GRID_LON_MIN + GRID_LON_MAX) / 2
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=7, tiles='cartodbpositron')
+    m = folium.Map(location=[GRID_ORIGIN_LAT, GRID_ORIGIN_LON], zoom_start=7, tiles='cartodbpositron')
 
     # Fix 404 Favicon Error
     m.get_root().header.add_child(folium.Element('<link rel="shortcut icon" href="favicon.ico" type="image/x-icon">'))
 
-    image_bounds = [[GRID_LAT_MIN, GRID_LON_MIN], [GRID_LAT_MAX, GRID_LON_MAX]]
-
     # Generate Layers
-    has_layer = False
-    
-    if generate_image_overlay(grid, 'reflectivity', 'overlay_ref.png', -10, 70, 'HomeyerRainbow'):
-        folium.raster_layers.ImageOverlay(
-            image='overlay_ref.png', bounds=image_bounds, opacity=0.7, name='Reflectivity', show=True
-        ).add_to(m)
-        has_layer = True
-
-    if generate_image_overlay(grid, 'velocity', 'overlay_vel.png', -30, 30, 'BuDRd18'):
-        folium.raster_layers.ImageOverlay(
-            image='overlay_vel.png', bounds=image_bounds, opacity=0.7, name='Velocity', show=False
-        ).add_to(m)
-
-    if generate_image_overlay(grid, 'cross_correlation_ratio', 'overlay_cc.png', 0.8, 1.0, 'RefDiff'):
-        folium.raster_layers.ImageOverlay(
-            image='overlay_cc.png', bounds=image_bounds, opacity=0.7, name='Correlation Coeff', show=False
-        ).add_to(m)
+    layers = generate_tile_layers(grid, tile_index(grid), fields)
+    for _, subdir, name, _, _, _, show in layers:
+        add_tile_layer(m, f'{TILE_DIR}/{subdir}', name, show)
 
     folium.LayerControl(collapsed=False).add_to(m)
     
@@ -146,10 +474,43 @@ def create_map(radars):
     m.save('index.html')
     print("Map saved to index.html")
     
-    if not has_layer:
+    if not layers:
         print("Warning: Map created but no layers were generated.")
+    return layers
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state, path=STATE_FILE):
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+def is_up_to_date(state, state_path=STATE_FILE, map_path='index.html'):
+    """True if the map on disk was built from `state` recently enough to reuse."""
+    if load_state(state_path) != state or not os.path.exists(map_path) or not os.path.isdir(TILE_DIR):
+        return False
+    return time.time() - os.path.getmtime(map_path) < STATE_MAX_AGE
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a merged NEXRAD radar map.")
+    parser.add_argument('--all-fields', action='store_true',
+                        help="Also grid velocity and correlation coefficient layers.")
+    parser.add_argument('--grid-shape', type=int, nargs=2, metavar=('NY', 'NX'),
+                        default=GRID_SHAPE[1:],
+                        help="Horizontal grid size (default: %(default)s).")
+    parser.add_argument('--nearest', action='store_true',
+                        help="Grid with nearest-neighbour weighting instead of Barnes (faster, blockier).")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    fields = DEFAULT_FIELDS + (EXTRA_FIELDS if args.all_fields else [])
+    weighting_function = 'Nearest' if args.nearest else 'Barnes2'
 
-def main():
     # 1. Create Dummy Favicon (prevents browser 404s)
     with open("favicon.ico", "wb") as f:
         f.write(base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"))
@@ -160,18 +521,31 @@ def main():
         print("CRITICAL: No scans found for any radar site. Exiting.")
         sys.exit(1) # Fail the action so we know!
 
+    def make_state(used_scans):
+        return {
+            'scans': {scan.site: scan.filename for scan in used_scans},
+            'fields': fields,
+            'grid_shape': list(args.grid_shape),
+            'weighting_function': weighting_function,
+        }
+
+    if is_up_to_date(make_state(scans)):
+        print("Map is up-to-date with the latest scans. Nothing to do.")
+        return
+
     # 3. Download & Process
-    radars = download_and_read_scans(scans)
-    if not radars:
+    loaded = download_and_read_scans(scans)
+    if not loaded:
         print("CRITICAL: Scans found but failed to read. Exiting.")
         sys.exit(1)
 
     # 4. Generate Map
-    create_map(radars)
-    
-    # 5. Cleanup
-    if os.path.exists('radar_data'):
-        shutil.rmtree('radar_data')
+    layers = create_map([radar for _, radar in loaded], fields, (1, *args.grid_shape), weighting_function)
+
+    # Record only the scans that made it into the map, so a site that failed
+    # this run doesn't match next time and gets retried
+    if layers:
+        save_state(make_state([scan for scan, _ in loaded]))
 
 if __name__ == "__main__":
     main()